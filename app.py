@@ -1,12 +1,11 @@
 from flask import Flask, jsonify, request, send_file
 from flask_cors import CORS
-import gspread
 import os
-import json
 import logging
 import base64
 from functools import wraps
 import io
+import math
 
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseUpload
@@ -21,6 +20,8 @@ logger = logging.getLogger("t360-api")
 
 # Import the upload blueprint
 from file_uploads import upload_bp
+from sheet_router import DEFAULT_SPREADSHEET_ID, open_spreadsheet, spreadsheet_for, get_worksheet, all_sheet_titles, resolve_route
+from upstream_guard import BREAKERS, UpstreamUnavailable, start_deadline, mark_stale_response, cached_read, drive_execute
 
 def upload_screenshot_to_drive(file_bytes, filename, folder_id):
     SCOPES = ['https://www.googleapis.com/auth/drive.file']
@@ -33,11 +34,11 @@ def upload_screenshot_to_drive(file_bytes, filename, folder_id):
     }
 
     media = MediaIoBaseUpload(io.BytesIO(file_bytes), mimetype='image/png')
-    uploaded = service.files().create(
+    uploaded = drive_execute(service.files().create(
         body=file_metadata,
         media_body=media,
         fields='id,webViewLink'
-    ).execute()
+    ))
 
     return uploaded.get('webViewLink')
 
@@ -47,18 +48,36 @@ CORS(app)
 # Register the upload blueprint
 app.register_blueprint(upload_bp)
 
+# Bound upstream time per request and flag responses served from stale cache
+app.before_request(start_deadline)
+app.after_request(mark_stale_response)
+
+@app.errorhandler(UpstreamUnavailable)
+def upstream_unavailable(e):
+    """Fail-fast and deadline errors are 503s, not bad requests."""
+    response = jsonify({"error": str(e)})
+    response.status_code = 503
+    retry_after = getattr(e, "retry_after", None)
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
 logger.info("✅ Flask app initialized and upload blueprint registered.") 
 
 @app.route("/", methods=["GET"])
 def index():
     return jsonify({"status": "Worker API online"}), 200
 
-# Load Google credentials
-with open("creds.json", "r") as f:
-    creds_dict = json.load(f)
+@app.route("/health", methods=["GET"])
+def health():
+    """Report circuit breaker state without calling Google."""
+    breakers = {name: breaker.snapshot() for name, breaker in list(BREAKERS.items())}
+    degraded = any(b["state"] != "closed" for b in breakers.values())
+    return jsonify({"status": "degraded" if degraded else "ok", "breakers": breakers}), 200
 
-gc = gspread.service_account_from_dict(creds_dict)
-spreadsheet = gc.open_by_key(os.environ.get("SPREADSHEET_ID"))
+# Load Google credentials and open the default spreadsheet up front;
+# other routed spreadsheets (see sheet_router.py) open on first use.
+open_spreadsheet(DEFAULT_SPREADSHEET_ID)
 
 # Authorization
 WRITE_KEY = os.environ.get("INVENTORY_WRITE_KEY")
@@ -96,7 +115,7 @@ def write_row():
             item = {k: v for k, v in data.items() if k != "sheet_name"}
 
         sheet_name = data.get("sheet_name")
-        worksheet = spreadsheet.worksheet(sheet_name)
+        worksheet = get_worksheet(sheet_name)
         headers = worksheet.row_values(1)
 
         # Expand headers for new keys
@@ -111,6 +130,8 @@ def write_row():
         worksheet.append_row(row)
 
         return jsonify({"message": "Row written", "row": row}), 200
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -132,6 +153,8 @@ def upload_screenshot():
 
         link = upload_screenshot_to_drive(file_bytes, filename, folder_id)
         return jsonify({"url": link}), 200
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -146,7 +169,7 @@ def write_passthrough():
 
         item = {k: v for k, v in data.items() if k != "sheet_name"}
 
-        worksheet = spreadsheet.worksheet(sheet_name)
+        worksheet = get_worksheet(sheet_name)
         headers = worksheet.row_values(1)
         new_keys = [key for key in item.keys() if key not in headers]
         if new_keys:
@@ -159,6 +182,8 @@ def write_passthrough():
 
         return jsonify({"message": "Row written", "row": row}), 200
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -167,7 +192,7 @@ def write_passthrough():
 def write_passthrough_log():
     try:
         data = request.get_json(force=True)
-        log_sheet = spreadsheet.worksheet("3.3_Test_Sandbox")
+        log_sheet = get_worksheet("3.3_Test_Sandbox")
         headers = log_sheet.row_values(1)
 
         # ✅ Accept all arbitrary keys (excluding reserved)
@@ -183,6 +208,8 @@ def write_passthrough_log():
         log_sheet.append_row(row)
 
         return jsonify({"message": "Logged payload successfully", "row": row}), 200
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -193,10 +220,12 @@ def update_headers():
     sheet_name = data.get("sheet_name")
     headers = data.get("headers")
     try:
-        worksheet = spreadsheet.worksheet(sheet_name)
+        worksheet = get_worksheet(sheet_name)
         worksheet.clear()
         worksheet.insert_row(headers, 1)
         return jsonify({"status": "headers updated"})
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
         
@@ -206,9 +235,10 @@ def get_sheet_headers():
     data = request.get_json(force=True)
     sheet_name = data.get("sheet_name")
     try:
-        worksheet = spreadsheet.worksheet(sheet_name)
-        headers = worksheet.row_values(1)
+        headers = cached_read(("headers", sheet_name), lambda: get_worksheet(sheet_name).row_values(1))
         return jsonify({"headers": headers}), 200
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -218,9 +248,10 @@ def get_all_sheet_data():
     data = request.get_json(force=True)
     sheet_name = data.get("sheet_name")
     try:
-        worksheet = spreadsheet.worksheet(sheet_name)
-        all_data = worksheet.get_all_values()
+        all_data = cached_read(("values", sheet_name), lambda: get_worksheet(sheet_name).get_all_values())
         return jsonify({"data": all_data}), 200
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -237,7 +268,7 @@ def log_event():
 def log_integration():
     try:
         data = request.get_json()
-        worksheet = spreadsheet.worksheet("1.2_Integration_Log")
+        worksheet = get_worksheet("1.2_Integration_Log")
         headers = worksheet.row_values(1)
         new_keys = [key for key in data.keys() if key not in headers]
         if new_keys:
@@ -246,6 +277,8 @@ def log_integration():
         row = [data.get(header, "") for header in headers]
         worksheet.append_row(row)
         return jsonify({"message": "Integration log added successfully"}), 200
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -256,11 +289,12 @@ def create_sheet():
     name = data.get("sheet_name")
     headers = data.get("headers", [])
     try:
-        spreadsheet.add_worksheet(title=name, rows="1000", cols="26")
+        worksheet = spreadsheet_for(name).add_worksheet(title=name, rows="1000", cols="26")
         if headers:
-            worksheet = spreadsheet.worksheet(name)
             worksheet.insert_row(headers, 1)
         return jsonify({"message": f"Sheet '{name}' created"})
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -271,10 +305,12 @@ def set_headers():
     sheet_name = data.get("sheet_name")
     headers = data.get("headers")
     try:
-        worksheet = spreadsheet.worksheet(sheet_name)
+        worksheet = get_worksheet(sheet_name)
         worksheet.clear()
         worksheet.insert_row(headers, 1)
         return jsonify({"message": "Headers updated successfully"})
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -285,7 +321,7 @@ def update_structure():
     sheet_name = data.get("sheet_name")
     remove_columns = data.get("remove_columns", [])
     try:
-        worksheet = spreadsheet.worksheet(sheet_name)
+        worksheet = get_worksheet(sheet_name)
         all_data = worksheet.get_all_values()
         if not all_data:
             return jsonify({"error": "Sheet is empty"}), 400
@@ -295,11 +331,12 @@ def update_structure():
         for row in all_data[1:]:
             new_row = [val for i, val in enumerate(row) if header[i] not in remove_columns]
             new_data.append(new_row)
+        # One batched write, so the rewrite is not spread over N requests
         worksheet.clear()
-        worksheet.append_row(new_header)
-        for row in new_data:
-            worksheet.append_row(row)
+        worksheet.update("A1", [new_header] + new_data)
         return jsonify({"message": "Structure updated"}), 200
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -309,53 +346,67 @@ def delete_sheet():
     data = request.get_json()
     sheet_name = data.get("sheet_name")
     try:
+        spreadsheet = spreadsheet_for(sheet_name)
         worksheet = spreadsheet.worksheet(sheet_name)
         spreadsheet.del_worksheet(worksheet)
         return jsonify({"message": f"Sheet '{sheet_name}' deleted"})
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 @app.route("/sheet/list_all", methods=["GET"])
 def list_all_sheets():
     try:
-        sheet_titles = [ws.title for ws in spreadsheet.worksheets()]
+        sheet_titles = cached_read(("titles",), all_sheet_titles)
         return jsonify({"sheets": sheet_titles})
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route("/inventory/<sheet_name>", methods=["GET"])
 def get_inventory(sheet_name):
+    def fetch_inventory():
+        worksheet = get_worksheet(sheet_name)
+        return worksheet.row_values(1), worksheet.get_all_values()
+
     try:
-        worksheet = spreadsheet.worksheet(sheet_name)
-        headers = worksheet.row_values(1)
-        all_values = worksheet.get_all_values()
+        headers, all_values = cached_read(("inventory", sheet_name), fetch_inventory)
         rows = all_values[1:] if len(all_values) > 1 else []
         records = [
             {headers[i]: row[i] if i < len(row) else "" for i in range(len(headers))}
             for row in rows
         ] if rows else []
         return jsonify(records if records else [{"headers_only": headers}]), 200
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 @app.route("/inventory/structured/<sheet_name>", methods=["GET"])
 def get_structured(sheet_name):
     try:
-        worksheet = spreadsheet.worksheet(sheet_name)
-        values = worksheet.get_all_values()
+        values = cached_read(("values", sheet_name), lambda: get_worksheet(sheet_name).get_all_values())
         headers = values[0] if values else []
         rows = values[1:] if len(values) > 1 else []
         return jsonify({"headers": headers, "rows": rows})
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 @app.route("/inventory/raw/<sheet_name>", methods=["GET"])
 def get_raw_sheet(sheet_name):
+    def fetch_raw():
+        worksheet = get_worksheet(sheet_name)
+        return worksheet.get(f"A1:Z{worksheet.row_count}")
+
     try:
-        worksheet = spreadsheet.worksheet(sheet_name)
-        max_rows = worksheet.row_count
-        raw = worksheet.get(f"A1:Z{max_rows}")
+        raw = cached_read(("raw", sheet_name), fetch_raw)
         return jsonify(raw), 200
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -363,8 +414,7 @@ def get_raw_sheet(sheet_name):
 def get_item(sheet_name, item_name):
     try:
         key_column = request.args.get("key_column")
-        worksheet = spreadsheet.worksheet(sheet_name)
-        records = worksheet.get_all_records()
+        records = cached_read(("records", sheet_name), lambda: get_worksheet(sheet_name).get_all_records())
         if not records:
             return jsonify({"error": "No data in sheet."}), 404
         match = None
@@ -375,6 +425,8 @@ def get_item(sheet_name, item_name):
         if match:
             return jsonify(match), 200
         return jsonify({"error": "Item not found"}), 404
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -385,9 +437,15 @@ def rename_sheet():
     old_name = data.get("old_name")
     new_name = data.get("new_name")
     try:
-        worksheet = spreadsheet.worksheet(old_name)
+        # Renaming can't move a sheet between spreadsheets, so the new name
+        # must route to the same spreadsheet or the sheet becomes unreachable.
+        if resolve_route(old_name) != resolve_route(new_name):
+            return jsonify({"error": f"'{new_name}' routes to a different spreadsheet than '{old_name}'"}), 400
+        worksheet = get_worksheet(old_name)
         worksheet.update_title(new_name)
         return jsonify({"message": f"Renamed {old_name} to {new_name}"})
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 400
         
@@ -402,7 +460,7 @@ def get_by_location():
         if not sheet_name or not location_id:
             return jsonify({"error": "Missing sheet_name or location_id"}), 400
 
-        worksheet = spreadsheet.worksheet(sheet_name)
+        worksheet = get_worksheet(sheet_name)
         headers = worksheet.row_values(1)
         all_values = worksheet.get_all_values()[1:]  # skip header
 
@@ -421,6 +479,8 @@ def get_by_location():
         else:
             return jsonify({"error": "No matching unified_log_id found"}), 404
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
         
@@ -441,6 +501,8 @@ def upload_base64_screenshot():
 
         return jsonify({"url": link}), 200
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -12,6 +12,8 @@ from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
 from google.oauth2 import service_account
 
+from upstream_guard import UpstreamUnavailable, drive_execute
+
 # ---------------------------------------------------------------------
 # Logging Setup
 # ---------------------------------------------------------------------
@@ -87,9 +89,9 @@ def upload_file():
         media = MediaFileUpload(temp_path, mimetype=uploaded_file.mimetype, resumable=True)
         metadata = {"name": uploaded_file.filename, "parents": [folder_id]}
 
-        uploaded = drive_service.files().create(
+        uploaded = drive_execute(drive_service.files().create(
             body=metadata, media_body=media, fields="id, name, parents, webViewLink"
-        ).execute()
+        ))
 
         os.remove(temp_path)
 
@@ -104,6 +106,8 @@ def upload_file():
             "drive_response": uploaded
         }), 200
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         import traceback
         err_trace = traceback.format_exc()
@@ -119,15 +123,16 @@ def upload_file():
 def drive_health_check():
     """
     Runs a quick health check to verify Drive API connectivity and folder access.
+    This makes a live Drive call (subject to the Drive breaker); use /health
+    for a cheap check that only reports breaker state.
     """
     import traceback
     try:
         folder_id = request.args.get("folder_id") or "15OAwN8yyMhUJFCeGK11_h7mptvSYWukN"
         # Query a few files from the folder to confirm access
-        results = (
+        results = drive_execute(
             drive_service.files()
             .list(q=f"'{folder_id}' in parents", pageSize=5, fields="files(id, name)")
-            .execute()
         )
         files = results.get("files", [])
         return jsonify({
@@ -135,6 +140,8 @@ def drive_health_check():
             "folder_checked": folder_id,
             "files_found": files
         }), 200
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         err_trace = traceback.format_exc()
         return jsonify({
@@ -0,0 +1,160 @@
+"""
+sheet_router.py – T360 Sharded Spreadsheet Routing
+Maps sheet names (exact or by prefix) to one of several spreadsheets,
+each optionally owned by its own service account, so that high-volume
+log sheets and inventory sheets do not share a single write quota.
+"""
+
+import os
+import json
+import logging
+import threading
+
+import gspread
+
+from upstream_guard import GuardedClient, get_breaker
+
+# ---------------------------------------------------------------------
+# Logging Setup
+# ---------------------------------------------------------------------
+logger = logging.getLogger("t360-api")
+
+# ---------------------------------------------------------------------
+# Routing Configuration
+# ---------------------------------------------------------------------
+# SHEET_ROUTES is an optional JSON list evaluated top to bottom, e.g.
+#   [{"prefix": "3.", "spreadsheet_id": "...", "creds_file": "logs-creds.json"},
+#    {"sheet": "1.2_Integration_Log", "spreadsheet_id": "..."}]
+# "sheet" matches an exact name, "prefix" matches the start of a name.
+# "creds_file" is optional and defaults to DEFAULT_CREDS_FILE.
+# Anything unmatched goes to the default SPREADSHEET_ID.
+# Existing sheets that a new route matches must be moved to the routed
+# spreadsheet before the route is enabled, or they become unreachable.
+DEFAULT_CREDS_FILE = "creds.json"
+DEFAULT_SPREADSHEET_ID = os.environ.get("SPREADSHEET_ID")
+
+
+def load_routes() -> list:
+    """Parse SHEET_ROUTES from the environment (empty list if unset)."""
+    raw = os.environ.get("SHEET_ROUTES")
+    if not raw:
+        return []
+    routes = json.loads(raw)
+    if not isinstance(routes, list):
+        raise ValueError(f"SHEET_ROUTES must be a JSON list of objects, got: {raw}")
+    for route in routes:
+        if not isinstance(route, dict):
+            raise ValueError(f"SHEET_ROUTES entry must be an object: {route}")
+        if not route.get("spreadsheet_id"):
+            raise ValueError(f"SHEET_ROUTES entry missing spreadsheet_id: {route}")
+        if not route.get("sheet") and not route.get("prefix"):
+            raise ValueError(f"SHEET_ROUTES entry needs 'sheet' or 'prefix': {route}")
+    return routes
+
+
+SHEET_ROUTES = load_routes()
+
+# ---------------------------------------------------------------------
+# Client & Spreadsheet Pools
+# ---------------------------------------------------------------------
+# One authenticated gspread client per service account, and one opened
+# Spreadsheet handle per ID. Separate clients keep separate HTTP sessions,
+# so writes routed to different spreadsheets can proceed in parallel.
+_clients = {}
+_spreadsheets = {}
+_pool_lock = threading.Lock()
+
+
+def get_client(creds_file: str = DEFAULT_CREDS_FILE) -> gspread.Client:
+    """Return the pooled gspread client for a service account key file."""
+    with _pool_lock:
+        client = _clients.get(creds_file)
+        if client is None:
+            with open(creds_file, "r") as f:
+                creds_dict = json.load(f)
+            # GuardedClient applies request deadlines and a Sheets breaker of
+            # its own, so one service account hitting its quota does not
+            # fail fast the spreadsheets owned by the others.
+            breaker = get_breaker(f"sheets:{creds_file}")
+            client = gspread.service_account_from_dict(
+                creds_dict, client_factory=lambda auth: GuardedClient(auth, breaker=breaker)
+            )
+            _clients[creds_file] = client
+            logger.info(f"🔑 gspread client created for {creds_file}")
+        return client
+
+
+def open_spreadsheet(spreadsheet_id: str, creds_file: str = DEFAULT_CREDS_FILE) -> gspread.Spreadsheet:
+    """Return the pooled Spreadsheet handle, opening it on first use."""
+    key = (spreadsheet_id, creds_file)
+    with _pool_lock:
+        spreadsheet = _spreadsheets.get(key)
+    if spreadsheet is not None:
+        return spreadsheet
+
+    spreadsheet = get_client(creds_file).open_by_key(spreadsheet_id)
+    with _pool_lock:
+        # Another thread may have opened it meanwhile; keep the first one.
+        spreadsheet = _spreadsheets.setdefault(key, spreadsheet)
+    logger.info(f"📄 Spreadsheet {spreadsheet_id} opened")
+    return spreadsheet
+
+
+# ---------------------------------------------------------------------
+# Routing
+# ---------------------------------------------------------------------
+def resolve_route(sheet_name: str) -> dict:
+    """Return the route (spreadsheet_id, creds_file) for a sheet name."""
+    for route in SHEET_ROUTES:
+        if route.get("sheet") and route["sheet"] == sheet_name:
+            break
+        if route.get("prefix") and (sheet_name or "").startswith(route["prefix"]):
+            break
+    else:
+        return {"spreadsheet_id": DEFAULT_SPREADSHEET_ID, "creds_file": DEFAULT_CREDS_FILE}
+    return {
+        "spreadsheet_id": route["spreadsheet_id"],
+        "creds_file": route.get("creds_file", DEFAULT_CREDS_FILE),
+    }
+
+
+def spreadsheet_for(sheet_name: str) -> gspread.Spreadsheet:
+    """Return the spreadsheet that owns the given sheet name."""
+    route = resolve_route(sheet_name)
+    return open_spreadsheet(route["spreadsheet_id"], route["creds_file"])
+
+
+def get_worksheet(sheet_name: str) -> gspread.Worksheet:
+    """Shortcut for spreadsheet_for(sheet_name).worksheet(sheet_name)."""
+    return spreadsheet_for(sheet_name).worksheet(sheet_name)
+
+
+def all_targets() -> list:
+    """Return every configured (spreadsheet_id, creds_file), default first, no duplicates."""
+    targets = [(DEFAULT_SPREADSHEET_ID, DEFAULT_CREDS_FILE)]
+    for route in SHEET_ROUTES:
+        target = (route["spreadsheet_id"], route.get("creds_file", DEFAULT_CREDS_FILE))
+        if target not in targets:
+            targets.append(target)
+    return targets
+
+
+def all_spreadsheets() -> list:
+    """Return every configured spreadsheet (default first, no duplicates)."""
+    return [open_spreadsheet(sid, creds_file) for sid, creds_file in all_targets()]
+
+
+def all_sheet_titles() -> list:
+    """
+    Return the titles of every reachable sheet across all spreadsheets.
+    Tabs whose name routes to a different spreadsheet than the one they
+    live in (e.g. a routed file's default "Sheet1") are left out, since
+    get_worksheet() would never look for them there.
+    """
+    titles = []
+    for spreadsheet_id, creds_file in all_targets():
+        target = {"spreadsheet_id": spreadsheet_id, "creds_file": creds_file}
+        for ws in open_spreadsheet(spreadsheet_id, creds_file).worksheets():
+            if resolve_route(ws.title) == target:
+                titles.append(ws.title)
+    return titles
@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+
+import pytest
+
+import sheet_router
+from sheet_router import all_sheet_titles, load_routes, resolve_route
+
+ROUTES = [
+    {"sheet": "3.5_log_index", "spreadsheet_id": "index", "creds_file": "index-creds.json"},
+    {"prefix": "3.", "spreadsheet_id": "logs", "creds_file": "logs-creds.json"},
+    {"prefix": "3.3_", "spreadsheet_id": "never"},
+    {"sheet": "1.2_Integration_Log", "spreadsheet_id": "integration"},
+]
+
+
+@pytest.fixture
+def routes(monkeypatch):
+    monkeypatch.setattr(sheet_router, "DEFAULT_SPREADSHEET_ID", "default")
+    monkeypatch.setattr(sheet_router, "SHEET_ROUTES", ROUTES)
+
+
+# ---------------------------------------------------------------------
+# Routing
+# ---------------------------------------------------------------------
+def test_exact_sheet_match(routes):
+    assert resolve_route("1.2_Integration_Log")["spreadsheet_id"] == "integration"
+    assert resolve_route("1.2_Integration_Log_old")["spreadsheet_id"] == "default"
+
+
+def test_prefix_match(routes):
+    assert resolve_route("3.1_Dev_Log") == {"spreadsheet_id": "logs", "creds_file": "logs-creds.json"}
+
+
+def test_first_match_wins(routes):
+    assert resolve_route("3.5_log_index")["spreadsheet_id"] == "index"
+    assert resolve_route("3.3_Test_Sandbox")["spreadsheet_id"] == "logs"
+
+
+def test_unmatched_falls_back_to_default(routes):
+    assert resolve_route("Inventory") == {"spreadsheet_id": "default", "creds_file": "creds.json"}
+    assert resolve_route(None)["spreadsheet_id"] == "default"
+
+
+def test_creds_file_defaults(routes):
+    assert resolve_route("1.2_Integration_Log")["creds_file"] == sheet_router.DEFAULT_CREDS_FILE
+
+
+# ---------------------------------------------------------------------
+# SHEET_ROUTES parsing
+# ---------------------------------------------------------------------
+def test_load_routes_unset(monkeypatch):
+    monkeypatch.delenv("SHEET_ROUTES", raising=False)
+    assert load_routes() == []
+
+
+def test_load_routes_valid(monkeypatch):
+    monkeypatch.setenv("SHEET_ROUTES", '[{"prefix": "3.", "spreadsheet_id": "logs"}]')
+    assert load_routes() == [{"prefix": "3.", "spreadsheet_id": "logs"}]
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        '{"prefix": "3.", "spreadsheet_id": "logs"}',
+        '["3."]',
+        '[{"prefix": "3."}]',
+        '[{"spreadsheet_id": "logs"}]',
+    ],
+)
+def test_load_routes_rejects_malformed(monkeypatch, raw):
+    monkeypatch.setenv("SHEET_ROUTES", raw)
+    with pytest.raises(ValueError):
+        load_routes()
+
+
+# ---------------------------------------------------------------------
+# Sheet listing
+# ---------------------------------------------------------------------
+def test_all_sheet_titles_hides_tabs_routed_elsewhere(routes, monkeypatch):
+    tabs = {
+        "default": ["Inventory", "3.1_Dev_Log", "1.2_Integration_Log"],
+        "index": ["3.5_log_index", "Sheet1"],
+        "logs": ["3.1_Dev_Log", "Sheet1"],
+        "never": ["3.3_Test_Sandbox"],
+        "integration": ["1.2_Integration_Log"],
+    }
+
+    def fake_open(spreadsheet_id, creds_file=sheet_router.DEFAULT_CREDS_FILE):
+        return SimpleNamespace(
+            worksheets=lambda: [SimpleNamespace(title=title) for title in tabs[spreadsheet_id]]
+        )
+
+    monkeypatch.setattr(sheet_router, "open_spreadsheet", fake_open)
+    assert all_sheet_titles() == ["Inventory", "3.5_log_index", "3.1_Dev_Log", "1.2_Integration_Log"]
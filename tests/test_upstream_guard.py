@@ -0,0 +1,235 @@
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask, g
+
+import upstream_guard
+from upstream_guard import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceeded,
+    GuardedClient,
+    UpstreamUnavailable,
+    admit,
+    cached_read,
+    start_deadline,
+    upstream_timeout,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(upstream_guard.time, "monotonic", fake)
+    return fake
+
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+
+def trip(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure(breaker.before_call(), "boom")
+
+
+# ---------------------------------------------------------------------
+# Circuit Breaker
+# ---------------------------------------------------------------------
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_seconds=30)
+    breaker.record_failure(breaker.before_call(), "boom")
+    breaker.record_failure(breaker.before_call(), "boom")
+    assert breaker.state == "closed"
+    breaker.record_failure(breaker.before_call(), "boom")
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError) as exc:
+        breaker.before_call()
+    assert exc.value.retry_after == 30
+
+
+def test_success_resets_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_seconds=30)
+    breaker.record_failure(breaker.before_call(), "boom")
+    breaker.record_success(breaker.before_call())
+    breaker.record_failure(breaker.before_call(), "boom")
+    assert breaker.state == "closed"
+
+
+def test_half_open_admits_single_trial(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=30)
+    trip(breaker)
+    clock.now += 29
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    clock.now += 1
+    trial = breaker.before_call()
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success(trial)
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+
+def test_failed_trial_reopens(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=30)
+    trip(breaker)
+    clock.now += 30
+    breaker.record_failure(breaker.before_call(), "still down")
+    assert breaker.state == "open"
+    assert breaker.snapshot()["retry_in_seconds"] == 30
+
+
+def test_late_results_do_not_move_open_breaker(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=30)
+    in_flight = [breaker.before_call(), breaker.before_call()]
+    breaker.record_failure(breaker.before_call(), "boom")
+    assert breaker.state == "open"
+    opened_at = breaker.opened_at
+
+    clock.now += 10
+    breaker.record_success(in_flight[0])
+    breaker.record_failure(in_flight[1], "late")
+    assert breaker.state == "open"
+    assert breaker.opened_at == opened_at
+
+
+def test_unenforced_call_is_admitted_but_never_the_trial(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=30)
+    trip(breaker)
+    clock.now += 30
+    breaker.record_success(breaker.before_call(enforce=False))
+    assert breaker.state == "open"
+    breaker.before_call()
+    assert breaker.state == "half_open"
+
+
+# ---------------------------------------------------------------------
+# Deadlines
+# ---------------------------------------------------------------------
+def test_timeout_shrinks_then_deadline_expires(app, clock):
+    with app.test_request_context():
+        start_deadline()
+        assert upstream_timeout() == upstream_guard.UPSTREAM_TIMEOUT_SECONDS
+        clock.now += upstream_guard.REQUEST_DEADLINE_SECONDS - 2
+        assert upstream_timeout() == pytest.approx(2)
+        clock.now += 2
+        with pytest.raises(DeadlineExceeded):
+            upstream_timeout()
+
+
+def test_committed_request_skips_deadline_and_breaker(app, clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=30)
+    with app.test_request_context():
+        start_deadline()
+        timeout, _ = admit(breaker, mutating=True)
+        assert timeout == upstream_guard.WRITE_TIMEOUT_SECONDS
+        trip(breaker)
+        clock.now += upstream_guard.REQUEST_DEADLINE_SECONDS + 1
+        timeout, _ = admit(breaker)
+        assert timeout == upstream_guard.WRITE_TIMEOUT_SECONDS
+
+    with app.test_request_context():
+        start_deadline()
+        with pytest.raises(CircuitOpenError):
+            admit(breaker, mutating=True)
+
+
+# ---------------------------------------------------------------------
+# Stale Cache
+# ---------------------------------------------------------------------
+def unavailable():
+    raise UpstreamUnavailable("sheets circuit is open")
+
+
+def test_cached_read_serves_stale_when_unavailable(app):
+    with app.test_request_context():
+        assert cached_read(("test", "fresh"), lambda: [["a"]]) == [["a"]]
+        assert g.get("served_stale_at") is None
+
+    with app.test_request_context():
+        assert cached_read(("test", "fresh"), unavailable) == [["a"]]
+        response = upstream_guard.mark_stale_response(app.response_class())
+        assert response.headers["X-Served-Stale"] == "true"
+
+
+def test_cached_read_without_cache_reraises(app):
+    with app.test_request_context():
+        with pytest.raises(UpstreamUnavailable):
+            cached_read(("test", "never-cached"), unavailable)
+
+
+def test_cached_read_does_not_mask_other_errors(app):
+    def bad_request():
+        raise ValueError("no such sheet")
+
+    with app.test_request_context():
+        cached_read(("test", "other"), lambda: [["a"]])
+        with pytest.raises(ValueError):
+            cached_read(("test", "other"), bad_request)
+
+
+# ---------------------------------------------------------------------
+# Sheets: guarded gspread client
+# ---------------------------------------------------------------------
+class StubSession:
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.calls = []
+
+    def request(self, **kwargs):
+        self.calls.append(kwargs)
+        return SimpleNamespace(
+            status_code=self.status_code,
+            ok=self.status_code < 400,
+            text="",
+            json=lambda: {"error": {"code": self.status_code, "message": "stub", "status": "STUB"}},
+        )
+
+
+def test_guarded_client_bounds_every_call(app):
+    session = StubSession()
+    client = GuardedClient(None, session=session, breaker=CircuitBreaker("test"))
+    with app.test_request_context():
+        start_deadline()
+        client.request("get", "https://sheets")
+        client.request("post", "https://sheets")
+        client.request("get", "https://sheets")
+    timeouts = [call["timeout"] for call in session.calls]
+    assert timeouts == [
+        upstream_guard.UPSTREAM_TIMEOUT_SECONDS,
+        upstream_guard.WRITE_TIMEOUT_SECONDS,
+        upstream_guard.WRITE_TIMEOUT_SECONDS,
+    ]
+
+
+@pytest.mark.parametrize("status_code", [429, 500, 503])
+def test_guarded_client_counts_degraded_responses(app, status_code):
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_seconds=30)
+    client = GuardedClient(None, session=StubSession(status_code), breaker=breaker)
+    with app.test_request_context():
+        for _ in range(2):
+            with pytest.raises(UpstreamUnavailable):
+                client.request("post", "https://sheets")
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        client.request("get", "https://sheets")
+
+
+def test_guarded_client_bad_request_is_not_a_failure(app):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=30)
+    client = GuardedClient(None, session=StubSession(400), breaker=breaker)
+    with app.test_request_context():
+        with pytest.raises(upstream_guard.APIError):
+            client.request("get", "https://sheets")
+    assert breaker.state == "closed"
@@ -0,0 +1,342 @@
+"""
+upstream_guard.py – T360 Google API Deadlines & Circuit Breakers
+Bounds how long a single request may spend waiting on Google, trips a
+per-backend circuit breaker (Sheets, Drive) when Google is degraded, and
+keeps the last good result of read endpoints to serve while it is open.
+"""
+
+import os
+import time
+import socket
+import logging
+import threading
+
+import gspread
+import httplib2
+import requests
+from flask import g, has_request_context
+from gspread.exceptions import APIError
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.errors import HttpError
+
+# ---------------------------------------------------------------------
+# Logging Setup
+# ---------------------------------------------------------------------
+logger = logging.getLogger("t360-api")
+
+# ---------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "25"))
+UPSTREAM_TIMEOUT_SECONDS = float(os.environ.get("UPSTREAM_TIMEOUT_SECONDS", "10"))
+# Socket timeout for writes and for every call after a request's first write.
+# Like all socket timeouts it bounds each connect/read wait, not the whole
+# transfer, so large Drive uploads that keep making progress are not cut off.
+WRITE_TIMEOUT_SECONDS = float(os.environ.get("WRITE_TIMEOUT_SECONDS", "30"))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("BREAKER_RESET_SECONDS", "30"))
+
+# Status codes that mean Google itself is struggling, as opposed to a bad
+# request (unknown sheet, missing permission) which says nothing about health.
+DEGRADED_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+# ---------------------------------------------------------------------
+# Errors
+# ---------------------------------------------------------------------
+class UpstreamUnavailable(Exception):
+    """Google could not be reached in time, or is known to be degraded."""
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    """The current request has used up its upstream time budget."""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    """The backend's circuit breaker is open; the call was not attempted."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# ---------------------------------------------------------------------
+# Per-Request Deadlines
+# ---------------------------------------------------------------------
+def start_deadline():
+    """Start the upstream time budget for the current request."""
+    g.upstream_deadline = time.monotonic() + REQUEST_DEADLINE_SECONDS
+
+
+def upstream_timeout() -> float:
+    """Timeout for the next upstream call: what is left of the budget, capped."""
+    deadline = g.get("upstream_deadline") if has_request_context() else None
+    if deadline is None:
+        return UPSTREAM_TIMEOUT_SECONDS
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded(f"Request deadline of {REQUEST_DEADLINE_SECONDS}s exceeded")
+    return min(remaining, UPSTREAM_TIMEOUT_SECONDS)
+
+
+# ---------------------------------------------------------------------
+# Circuit Breaker
+# ---------------------------------------------------------------------
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open breaker.
+    After `failure_threshold` consecutive failures the breaker opens and
+    every call fails fast for `reset_seconds`; then a single trial call is
+    let through, and its outcome closes or re-opens the breaker.
+
+    before_call() hands out a token that must be passed back to
+    record_success()/record_failure(). Every state change bumps the
+    generation, so calls that were already in flight when the breaker
+    changed state cannot close or re-arm it when they finish late.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self.generation = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def _retry_in(self):
+        if self.state == "open":
+            return max(0.0, round(self.reset_seconds - (time.monotonic() - self.opened_at), 1))
+        if self.state == "half_open":
+            return 1.0
+        return None
+
+    def _transition(self, state):
+        self.state = state
+        self.generation += 1
+        self._trial_in_flight = False
+        if state == "open":
+            self.opened_at = time.monotonic()
+            logger.warning(f"🔴 {self.name} circuit opened after {self.failures} failures: {self.last_error}")
+        else:
+            self.failures = 0
+            self.opened_at = None
+            logger.info(f"🟢 {self.name} circuit closed")
+
+    def before_call(self, enforce=True):
+        """
+        Admit a call and return its token, or raise CircuitOpenError.
+        With enforce=False the call is always admitted (used for the later
+        steps of a write already in progress) but can never be the trial.
+        """
+        with self._lock:
+            if enforce and self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+            if self.state == "closed" or not enforce:
+                return (self.generation, False)
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return (self.generation, True)
+            raise CircuitOpenError(
+                f"{self.name} circuit is {self.state}; failing fast", retry_after=self._retry_in()
+            )
+
+    def record_success(self, token):
+        generation, trial = token
+        with self._lock:
+            if generation != self.generation:
+                return
+            if trial:
+                self._transition("closed")
+            elif self.state == "closed":
+                self.failures = 0
+
+    def record_failure(self, token, error):
+        generation, trial = token
+        with self._lock:
+            if generation != self.generation:
+                return
+            self.last_error = str(error)
+            if trial:
+                self._transition("open")
+            elif self.state == "closed":
+                self.failures += 1
+                if self.failures >= self.failure_threshold:
+                    self._transition("open")
+
+    def snapshot(self) -> dict:
+        """Current state for the health endpoint (no upstream calls)."""
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "retry_in_seconds": self._retry_in(),
+                "last_error": self.last_error,
+            }
+
+
+# One breaker per backend: "drive", plus one "sheets:<creds_file>" per pooled
+# gspread client so a quota-limited shard cannot trip the others.
+BREAKERS = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Return the named breaker, creating it on first use."""
+    with _breakers_lock:
+        breaker = BREAKERS.get(name)
+        if breaker is None:
+            breaker = BREAKERS[name] = CircuitBreaker(name)
+        return breaker
+
+
+drive_breaker = get_breaker("drive")
+
+
+def admit(breaker, mutating=False):
+    """
+    Check the deadline and breaker before an upstream call.
+    Returns (timeout, token). A request's first mutating call is the last
+    one the deadline and breaker can reject: from then on the request is
+    committed, so a multi-step write (clear + rewrite, delete + insert
+    header) is not abandoned halfway just because the budget ran out.
+    Writes and committed calls still get WRITE_TIMEOUT_SECONDS as their
+    socket timeout, so a stalled Google cannot hold a worker forever.
+    """
+    in_request = has_request_context()
+    if in_request and g.get("upstream_committed"):
+        return WRITE_TIMEOUT_SECONDS, breaker.before_call(enforce=False)
+    timeout = upstream_timeout()
+    token = breaker.before_call()
+    if mutating:
+        if in_request:
+            g.upstream_committed = True
+        timeout = WRITE_TIMEOUT_SECONDS
+    return timeout, token
+
+
+# ---------------------------------------------------------------------
+# Sheets: guarded gspread client
+# ---------------------------------------------------------------------
+class GuardedClient(gspread.Client):
+    """gspread client whose every HTTP call honours the deadline and breaker."""
+
+    def __init__(self, auth, session=None, breaker=None):
+        super().__init__(auth, session=session)
+        self.breaker = breaker or get_breaker("sheets")
+
+    def request(self, method, endpoint, params=None, data=None, json=None, files=None, headers=None):
+        timeout, token = admit(self.breaker, mutating=method.lower() != "get")
+        try:
+            response = self.session.request(
+                method=method,
+                url=endpoint,
+                params=params,
+                data=data,
+                json=json,
+                files=files,
+                headers=headers,
+                timeout=timeout,
+            )
+        except requests.exceptions.RequestException as e:
+            self.breaker.record_failure(token, e)
+            raise UpstreamUnavailable(f"Sheets request failed: {e}") from e
+        except Exception as e:
+            self.breaker.record_failure(token, e)
+            raise
+
+        if response.status_code in DEGRADED_STATUS_CODES:
+            self.breaker.record_failure(token, f"HTTP {response.status_code}")
+            raise UpstreamUnavailable(f"Sheets returned HTTP {response.status_code}")
+        self.breaker.record_success(token)
+        if response.ok:
+            return response
+        raise APIError(response)
+
+
+# ---------------------------------------------------------------------
+# Drive: guarded request execution
+# ---------------------------------------------------------------------
+# httplib2.Http is not thread-safe, so each worker thread keeps its own
+# and reuses it (and its open TLS connections) across Drive calls.
+_drive_http = threading.local()
+
+
+def _thread_drive_http(credentials, timeout):
+    http = getattr(_drive_http, "http", None)
+    if http is None:
+        http = _drive_http.http = AuthorizedHttp(credentials, http=httplib2.Http(timeout=timeout))
+    http.credentials = credentials
+    http.http.timeout = timeout
+    for conn in http.http.connections.values():
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+    return http
+
+
+def drive_execute(drive_request):
+    """
+    Execute a googleapiclient Drive request under the deadline and breaker.
+    The request goes over this thread's reused Http, with its socket timeout
+    set by admit(): what remains of the budget for reads, WRITE_TIMEOUT_SECONDS
+    for uploads.
+    """
+    timeout, token = admit(drive_breaker, mutating=drive_request.method != "GET")
+    try:
+        http = _thread_drive_http(drive_request.http.credentials, timeout)
+        result = drive_request.execute(http=http)
+    except HttpError as e:
+        if e.resp.status in DEGRADED_STATUS_CODES:
+            drive_breaker.record_failure(token, e)
+            raise UpstreamUnavailable(f"Drive returned HTTP {e.resp.status}") from e
+        drive_breaker.record_success(token)
+        raise
+    except (socket.timeout, OSError, httplib2.HttpLib2Error) as e:
+        drive_breaker.record_failure(token, e)
+        raise UpstreamUnavailable(f"Drive request failed: {e}") from e
+    except Exception as e:
+        drive_breaker.record_failure(token, e)
+        raise
+    drive_breaker.record_success(token)
+    return result
+
+
+# ---------------------------------------------------------------------
+# Stale Cache for Read Endpoints
+# ---------------------------------------------------------------------
+_stale_cache = {}
+_stale_lock = threading.Lock()
+
+
+def cached_read(key, fetch):
+    """
+    Run `fetch()` and remember its result under `key`. If Google is
+    unavailable (breaker open, deadline hit, transport error) and a previous
+    result exists, return that instead and flag the response as stale.
+    """
+    try:
+        result = fetch()
+    except UpstreamUnavailable as e:
+        with _stale_lock:
+            cached = _stale_cache.get(key)
+        if cached is None:
+            raise
+        logger.warning(f"⚠️ Serving stale data for {key}: {e}")
+        g.served_stale_at = cached[0]
+        return cached[1]
+    with _stale_lock:
+        _stale_cache[key] = (time.time(), result)
+    return result
+
+
+def mark_stale_response(response):
+    """after_request hook: tell clients when a response came from the stale cache."""
+    stale_at = g.get("served_stale_at")
+    if stale_at is not None:
+        response.headers["X-Served-Stale"] = "true"
+        response.headers["X-Stale-Since"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(stale_at))
+    return response